@@ -1,2 +1,6 @@
 from . import devices
 from .client import PetSafeClient
+from .commands import CommandQueue
+from .analytics import FeedingRollup
+from .resilience import CircuitBreaker, CircuitOpenError, RequestNotSentError
+from .transport import RecordingTransport, ReplayTransport
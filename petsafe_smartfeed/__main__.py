@@ -1,34 +1,456 @@
 import argparse
+import json
+import os
 import sys
+import time
 
 import petsafe_smartfeed as sf
 
-# create parser for arguments
-parser = argparse.ArgumentParser(usage="python -m petsafe_smartfeed email [-t email_code]")
-parser.add_argument("email", help="account email address")
-
-# if no arguments specified, show help
-if len(sys.argv) < 2:
-    parser.print_help()
-    sys.exit(1)
-
-# parse for arguments
-args = parser.parse_args()
-
-client = sf.PetSafeClient(email=args.email)
-client.request_code()
-print("Code requested, please check your email.")
-print("")
-
-code = input("Enter email code: ")
-client.request_tokens_from_code(code)
-
-print("")
-print("IdToken:")
-print(client.id_token)
-print("")
-print("AccessToken:")
-print(client.access_token)
-print("")
-print("RefreshToken:")
-print(client.refresh_token)
+COMMANDS = (
+    "login",
+    "status",
+    "feed",
+    "pause",
+    "schedules",
+    "messages",
+    "watch",
+    "exporter",
+)
+
+TOKEN_FIELDS = ("email", "id_token", "refresh_token", "access_token")
+
+STATUS_FIELDS = (
+    "feeder",
+    "friendly_name",
+    "battery_level",
+    "battery_voltage",
+    "food_low_status",
+    "paused",
+    "slow_feed",
+    "child_lock",
+)
+
+RESULT_FIELDS = ("feeder", "friendly_name", "ok", "error")
+
+MESSAGE_FIELDS = (
+    "feeder",
+    "id",
+    "message_type",
+    "created_at",
+    "amount",
+    "ok",
+    "error",
+)
+
+
+def default_tokens_path():
+    return os.environ.get(
+        "PETSAFE_TOKENS", os.path.join(os.path.expanduser("~"), ".petsafe_tokens.json")
+    )
+
+
+def load_client(path):
+    """
+    Creates a client from the stored tokens.
+
+    """
+    try:
+        with open(path) as fh:
+            tokens = json.load(fh)
+    except FileNotFoundError:
+        sys.exit("No tokens found at %s, run the login command first." % path)
+
+    client = sf.PetSafeClient(**{field: tokens.get(field) for field in TOKEN_FIELDS})
+    client.token_expires_time = tokens.get("token_expires_time", 0)
+    return client
+
+
+def save_client(client, path):
+    """
+    Stores the client's tokens, readable only by the current user.
+
+    """
+    tokens = {field: getattr(client, field) for field in TOKEN_FIELDS}
+    tokens["token_expires_time"] = client.token_expires_time
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as fh:
+        json.dump(tokens, fh, indent=2)
+
+
+class Writer:
+    def __init__(self, output_format, fields, stream=None):
+        """
+        Writes result rows as NDJSON or CSV, flushing after every row.
+
+        """
+        if stream is None:
+            stream = sys.stdout
+        self.stream = stream
+        if output_format == "csv":
+            import csv
+
+            self._csv = csv.DictWriter(stream, fields, extrasaction="ignore")
+            self._csv.writeheader()
+        else:
+            self._csv = None
+
+    def write(self, row):
+        if self._csv is not None:
+            self._csv.writerow(
+                {
+                    key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                    for key, value in row.items()
+                }
+            )
+        else:
+            self.stream.write(json.dumps(row) + "\n")
+        self.stream.flush()
+
+
+def run_parallel(task, items, writer, workers):
+    """
+    Runs `task(item, emit)` for every item on a thread pool.
+
+    Rows passed to `emit` are written by the calling thread as soon as they
+    are produced. A task raising an exception emits an error row instead.
+
+    Returns
+    -------
+    int
+        Number of failed tasks
+
+    """
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+
+    rows = queue.Queue()
+    done = object()
+
+    def run(item):
+        try:
+            task(item, rows.put)
+        except Exception as error:
+            rows.put(result(item, ok=False, error=str(error)))
+        finally:
+            rows.put(done)
+
+    failed = 0
+    remaining = len(items)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for item in items:
+            executor.submit(run, item)
+        while remaining:
+            row = rows.get()
+            if row is done:
+                remaining -= 1
+                continue
+            if row.get("ok") is False:
+                failed += 1
+            writer.write(row)
+    return failed
+
+
+def select_feeders(client, args, require_selection=False):
+    """
+    Feeders matching `--feeder` (thing name or friendly name), or all of them.
+
+    """
+    if require_selection and not args.feeder and not args.all:
+        sys.exit("Select feeders with --feeder or use --all.")
+    feeders = client.feeders
+    if args.feeder:
+        wanted = set(args.feeder)
+        feeders = [
+            feeder
+            for feeder in feeders
+            if feeder.api_name in wanted
+            or feeder.data.get("settings", {}).get("friendly_name") in wanted
+        ]
+    return feeders
+
+
+def feeder_status(feeder):
+    row = {"feeder": feeder.api_name}
+    for field in STATUS_FIELDS[1:]:
+        try:
+            row[field] = getattr(feeder, field)
+        except (KeyError, TypeError, ValueError):
+            row[field] = None
+    return row
+
+
+def result(feeder, ok=True, **extra):
+    row = {
+        "feeder": feeder.api_name,
+        "friendly_name": feeder.data.get("settings", {}).get("friendly_name"),
+        "ok": ok,
+    }
+    row.update(extra)
+    return row
+
+
+def command_login(args):
+    client = sf.PetSafeClient(email=args.email)
+    client.request_code()
+    print("Code requested, please check your email.")
+    print("")
+
+    code = input("Enter email code: ")
+    client.request_tokens_from_code(code)
+
+    if args.print_tokens:
+        print("")
+        print("IdToken:")
+        print(client.id_token)
+        print("")
+        print("AccessToken:")
+        print(client.access_token)
+        print("")
+        print("RefreshToken:")
+        print(client.refresh_token)
+
+    save_client(client, args.tokens)
+    print("")
+    print("Tokens saved to " + args.tokens)
+    return 0
+
+
+def command_status(args, client):
+    writer = Writer(args.format, STATUS_FIELDS)
+    for feeder in select_feeders(client, args):
+        writer.write(feeder_status(feeder))
+    return 0
+
+
+def command_feed(args, client):
+    def feed(feeder, emit):
+        feeder.feed(args.amount, args.slow_feed, update_data=False)
+        emit(result(feeder))
+
+    feeders = select_feeders(client, args, require_selection=True)
+    writer = Writer(args.format, RESULT_FIELDS)
+    return int(run_parallel(feed, feeders, writer, args.workers) > 0)
+
+
+def command_pause(args, client):
+    def pause(feeder, emit):
+        feeder.put_setting("paused", not args.resume)
+        emit(result(feeder))
+
+    feeders = select_feeders(client, args, require_selection=True)
+    writer = Writer(args.format, RESULT_FIELDS)
+    return int(run_parallel(pause, feeders, writer, args.workers) > 0)
+
+
+def command_schedules_apply(args, client):
+    with open(args.file) as fh:
+        wanted = [(item["time"][:5], int(item["amount"])) for item in json.load(fh)]
+
+    def apply(feeder, emit):
+        added = deleted = 0
+        missing = list(wanted)
+        for schedule in feeder.get_schedules():
+            current = (schedule["time"][:5], int(schedule["amount"]))
+            if current in missing:
+                missing.remove(current)
+            else:
+                feeder.delete_schedule(str(schedule["id"]), update_data=False)
+                deleted += 1
+        for schedule_time, amount in missing:
+            feeder.add_schedule(schedule_time, amount, update_data=False)
+            added += 1
+        emit(result(feeder, added=added, deleted=deleted))
+
+    feeders = select_feeders(client, args, require_selection=True)
+    writer = Writer(args.format, RESULT_FIELDS + ("added", "deleted"))
+    return int(run_parallel(apply, feeders, writer, args.workers) > 0)
+
+
+def command_messages_export(args, client):
+    def export(feeder, emit):
+        for message in feeder.iter_messages(days=args.days, types=args.type):
+            row = {"feeder": feeder.api_name}
+            row.update(message)
+            emit(row)
+
+    feeders = select_feeders(client, args)
+    writer = Writer(args.format, MESSAGE_FIELDS)
+    return int(run_parallel(export, feeders, writer, args.workers) > 0)
+
+
+def command_watch(args, client):
+    writer = Writer(args.format, ("time",) + STATUS_FIELDS)
+    previous = {}
+    count = 0
+    try:
+        while True:
+            now = time.time()
+            for feeder in select_feeders(client, args):
+                row = feeder_status(feeder)
+                if previous.get(row["feeder"]) != row:
+                    previous[row["feeder"]] = row
+                    writer.write(dict(row, time=now))
+            count += 1
+            if args.count and count >= args.count:
+                return 0
+            time.sleep(max(args.interval - (time.time() - now), 0))
+    except KeyboardInterrupt:
+        return 0
+
+
+def command_exporter(args, client):
+    from petsafe_smartfeed.exporter import FleetExporter
+
+    exporter = FleetExporter(client, interval=args.interval)
+    try:
+        exporter.serve(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def add_selection(parser, output=True):
+    parser.add_argument(
+        "--feeder",
+        action="append",
+        metavar="NAME",
+        help="feeder thing name or friendly name (repeatable)",
+    )
+    parser.add_argument("--all", action="store_true", help="use all feeders")
+    if output:
+        parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument(
+        "--workers", type=int, default=16, help="feeders processed in parallel"
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m petsafe_smartfeed")
+    parser.add_argument(
+        "--tokens",
+        default=default_tokens_path(),
+        help="token file (default: $PETSAFE_TOKENS or ~/.petsafe_tokens.json)",
+    )
+    parser.add_argument(
+        "--record", metavar="PATH", help="record API requests and responses to a file"
+    )
+    parser.add_argument(
+        "--replay", metavar="PATH", help="answer API requests from a recording"
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    login = commands.add_parser("login", help="request tokens with an email code")
+    login.add_argument("email", help="account email address")
+    login.add_argument(
+        "--no-print",
+        dest="print_tokens",
+        action="store_false",
+        help="do not print tokens",
+    )
+    login.set_defaults(handler=command_login, needs_client=False)
+
+    status = commands.add_parser("status", help="print the state of feeders")
+    add_selection(status)
+    status.set_defaults(handler=command_status)
+
+    feed = commands.add_parser("feed", help="start a feeding")
+    add_selection(feed)
+    feed.add_argument("--amount", type=int, default=1, help="amount in 1/8 cups")
+    feed.add_argument("--slow", dest="slow_feed", action="store_true", default=None)
+    feed.add_argument("--no-slow", dest="slow_feed", action="store_false")
+    feed.set_defaults(handler=command_feed)
+
+    pause = commands.add_parser("pause", help="pause (or resume) scheduled feeds")
+    add_selection(pause)
+    pause.add_argument("--resume", action="store_true", help="unpause instead")
+    pause.set_defaults(handler=command_pause)
+
+    schedules = commands.add_parser("schedules", help="manage scheduled feeds")
+    schedules_commands = schedules.add_subparsers(dest="action", metavar="action")
+    schedules_commands.required = True
+    apply = schedules_commands.add_parser(
+        "apply", help="make feeders' schedules match a JSON file"
+    )
+    apply.add_argument("file", help='JSON list of {"time": "HH:MM", "amount": N}')
+    add_selection(apply)
+    apply.set_defaults(handler=command_schedules_apply)
+
+    messages = commands.add_parser("messages", help="feeder messages")
+    messages_commands = messages.add_subparsers(dest="action", metavar="action")
+    messages_commands.required = True
+    export = messages_commands.add_parser("export", help="stream messages")
+    export.add_argument("--days", type=int, default=7)
+    export.add_argument(
+        "--type", action="append", metavar="MESSAGE_TYPE", help="(repeatable)"
+    )
+    add_selection(export)
+    export.set_defaults(handler=command_messages_export)
+
+    watch = commands.add_parser("watch", help="print feeder state changes")
+    add_selection(watch)
+    watch.add_argument(
+        "--interval",
+        type=float,
+        default=300,
+        help="seconds between requests (PetSafe locks accounts polled too often)",
+    )
+    watch.add_argument("--count", type=int, default=0, help="stop after N polls")
+    watch.set_defaults(handler=command_watch)
+
+    exporter = commands.add_parser("exporter", help="serve Prometheus metrics")
+    exporter.add_argument("--host", default="", help="address to listen on")
+    exporter.add_argument("--port", type=int, default=9100)
+    exporter.add_argument(
+        "--interval",
+        type=float,
+        default=300,
+        help="seconds between requests (PetSafe locks accounts polled too often)",
+    )
+    exporter.set_defaults(handler=command_exporter)
+
+    return parser
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = build_parser()
+
+    # if no arguments specified, show help
+    if not argv:
+        parser.print_help()
+        return 1
+
+    # `python -m petsafe_smartfeed email` is kept as an alias of `login email`
+    if argv[0] not in COMMANDS and not argv[0].startswith("-"):
+        argv = ["login"] + list(argv)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+
+    if not getattr(args, "needs_client", True):
+        return args.handler(args)
+
+    if args.replay:
+        from petsafe_smartfeed.transport import replay_client
+
+        return args.handler(args, replay_client(args.replay))
+
+    client = load_client(args.tokens)
+    if args.record:
+        from petsafe_smartfeed.transport import RecordingTransport
+
+        client.transport = RecordingTransport(args.record)
+    try:
+        return args.handler(args, client)
+    finally:
+        if args.record:
+            client.transport.close()
+        save_client(client, args.tokens)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,469 @@
+import calendar
+import json
+import math
+import time
+from datetime import datetime
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+MANUAL = "manual"
+SCHEDULED = "scheduled"
+
+# bucket layout: [manual feeds, manual amount, scheduled feeds, scheduled amount]
+_FIELDS = ("manual_feeds", "manual_amount", "scheduled_feeds", "scheduled_amount")
+
+
+def message_time(message):
+    """
+    Timestamp of a feeder message.
+
+    Parameters
+    ----------
+    message : dict
+        Message returned by `DeviceSmartFeed.get_messages_since`
+
+    Returns
+    -------
+    float
+        Seconds since the epoch (UTC)
+
+    """
+    value = message["created_at"]
+    if isinstance(value, (int, float)):
+        return float(value)
+    # "2021-06-01T08:00:00.000Z", "2021-06-01 08:00:00", ...
+    value = value.replace("T", " ")[:19]
+    return float(calendar.timegm(time.strptime(value, "%Y-%m-%d %H:%M:%S")))
+
+
+def feed_source(message):
+    """
+    Whether a `FEED_DONE` message comes from a schedule or a manual feed.
+
+    Parameters
+    ----------
+    message : dict
+        `FEED_DONE` message
+
+    Returns
+    -------
+    str
+        "scheduled" or "manual"
+
+    """
+    source = message.get("source")
+    if source is None and isinstance(message.get("payload"), dict):
+        source = message["payload"].get("source")
+    if source is not None and "schedul" in str(source).lower():
+        return SCHEDULED
+    return MANUAL
+
+
+def _add(buckets, key, offset, amount):
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = [0, 0, 0, 0]
+    bucket[offset] += 1
+    bucket[offset + 1] += amount
+
+
+def _prune(buckets, cutoff):
+    for key in [key for key in buckets if key < cutoff]:
+        del buckets[key]
+
+
+def _message_key(message):
+    if message.get("id") is not None:
+        return str(message["id"])
+    return "%s|%s" % (message.get("created_at"), message.get("amount"))
+
+
+def _select(buckets, start, end):
+    return sorted(
+        (key, bucket)
+        for key, bucket in buckets.items()
+        if (start is None or key >= start) and (end is None or key < end)
+    )
+
+
+def _row(key, bucket, label):
+    row = {label: datetime.utcfromtimestamp(key).isoformat()}
+    row.update(zip(_FIELDS, bucket))
+    row["feeds"] = bucket[0] + bucket[2]
+    row["amount"] = bucket[1] + bucket[3]
+    return row
+
+
+def _epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return float(calendar.timegm(value.utctimetuple()))
+
+
+class _FeederRollup:
+    __slots__ = ("watermark", "applied", "hourly", "daily")
+
+    def __init__(self):
+        self.watermark = 0.0
+        # message key -> timestamp, for every message inside `dedupe_days`
+        self.applied = {}
+        self.hourly = {}
+        self.daily = {}
+
+
+class FeedingRollup:
+    def __init__(
+        self, hourly_days=7, daily_days=120, source=feed_source, dedupe_days=14
+    ):
+        """
+        Incremental feeding consumption rollups for a fleet of feeders.
+
+        Only `FEED_DONE` messages are counted. Each message is applied once,
+        by message ID: feeding the same messages again (e.g. overlapping
+        `get_messages_since` windows) does not change the totals, while
+        messages received late (e.g. from a feeder that was offline) are still
+        counted. IDs are only remembered for `dedupe_days`, so older messages
+        (or older than `daily_days`) are ignored and counted in `expired`.
+        Fleet-wide totals are kept next to the per-feeder ones, so fleet
+        queries do not depend on the number of feeders.
+
+        Parameters
+        ----------
+        hourly_days : int, optional
+            Number of days hourly buckets are kept.
+            Defaults to 7.
+        daily_days : int, optional
+            Number of days daily buckets are kept.
+            Defaults to 120.
+        source : callable, optional
+            Function returning "manual" or "scheduled" for a message.
+            Defaults to `feed_source`.
+        dedupe_days : int, optional
+            Number of days message IDs are kept to apply messages once. Must
+            cover the `max_days` and `late_days` of `refresh`.
+            Defaults to 14.
+
+        Examples
+        --------
+        >>> rollup = FeedingRollup.load("rollup.json")
+        >>> for feeder in client.feeders:
+        ...     rollup.refresh(feeder)
+        >>> rollup.save("rollup.json")
+        >>> rollup.daily(start=datetime(2021, 6, 1))
+
+        """
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+        self.dedupe_days = dedupe_days
+        self.source = source
+        self._feeders = {}
+        self._fleet_hourly = {}
+        self._fleet_daily = {}
+        self._pruned_at = None
+        self.expired = 0
+
+    @property
+    def feeders(self):
+        """
+        Thing names of all feeders with data.
+
+        """
+        return list(self._feeders)
+
+    def watermark(self, thing_name):
+        """
+        Timestamp of the most recent message applied for a feeder.
+
+        Returns
+        -------
+        float or None
+            Seconds since the epoch (UTC), or None if nothing was applied
+
+        """
+        state = self._feeders.get(thing_name)
+        if state is None or not state.watermark:
+            return None
+        return state.watermark
+
+    def update(self, thing_name, messages):
+        """
+        Applies feeder messages that were not applied before.
+
+        Parameters
+        ----------
+        thing_name : str
+            Feeder's thing_name from the API
+        messages : iterable of dict
+            Messages returned by `DeviceSmartFeed.get_messages_since`,
+            in any order
+
+        Returns
+        -------
+        int
+            Number of feedings added
+
+        """
+        state = self._feeders.get(thing_name)
+        if state is None:
+            state = self._feeders[thing_name] = _FeederRollup()
+
+        hourly_cutoff, daily_cutoff, dedupe_cutoff = self._cutoffs()
+        added = 0
+
+        for message in messages:
+            if message.get("message_type") != "FEED_DONE":
+                continue
+            key = _message_key(message)
+            if key in state.applied:
+                continue
+            timestamp = message_time(message)
+            day = int(timestamp // DAY) * DAY
+            if day < daily_cutoff or timestamp < dedupe_cutoff:
+                self.expired += 1
+                continue
+
+            state.applied[key] = timestamp
+            if timestamp > state.watermark:
+                state.watermark = timestamp
+
+            offset = 0 if self.source(message) == MANUAL else 2
+            amount = message.get("amount") or 0
+            hour = int(timestamp // HOUR) * HOUR
+            if hour >= hourly_cutoff:
+                _add(state.hourly, hour, offset, amount)
+                _add(self._fleet_hourly, hour, offset, amount)
+            _add(state.daily, day, offset, amount)
+            _add(self._fleet_daily, day, offset, amount)
+            added += 1
+
+        return added
+
+    def refresh(self, feeder, max_days=7, late_days=1):
+        """
+        Requests and applies the messages a feeder produced since its last
+        applied message, plus `late_days` before it for messages received
+        late.
+
+        Parameters
+        ----------
+        feeder : DeviceSmartFeed
+            Feeder to refresh
+        max_days : int, optional
+            Maximum number of days to request back, at most `dedupe_days`.
+            Defaults to 7.
+        late_days : int, optional
+            Days requested before the last applied message.
+            Defaults to 1.
+
+        Returns
+        -------
+        int
+            Number of feedings added
+
+        """
+        watermark = self.watermark(feeder.api_name)
+        days = min(max_days, self.dedupe_days)
+        if watermark is not None:
+            elapsed = int(math.ceil((time.time() - watermark) / DAY))
+            days = min(max(elapsed, 1) + late_days, days)
+        return self.update(
+            feeder.api_name, feeder.iter_messages(days, types="FEED_DONE")
+        )
+
+    def _cutoffs(self):
+        now = time.time()
+        hourly_cutoff = int((now - self.hourly_days * DAY) // HOUR) * HOUR
+        daily_cutoff = int((now - self.daily_days * DAY) // DAY) * DAY
+        dedupe_cutoff = int((now - self.dedupe_days * DAY) // HOUR) * HOUR
+        # prune at most once per hour; buckets only expire at that granularity
+        if self._pruned_at != hourly_cutoff:
+            self._pruned_at = hourly_cutoff
+            for state in self._feeders.values():
+                _prune(state.hourly, hourly_cutoff)
+                _prune(state.daily, daily_cutoff)
+                state.applied = {
+                    key: timestamp
+                    for key, timestamp in state.applied.items()
+                    if timestamp >= dedupe_cutoff
+                }
+            _prune(self._fleet_hourly, hourly_cutoff)
+            _prune(self._fleet_daily, daily_cutoff)
+        return hourly_cutoff, daily_cutoff, dedupe_cutoff
+
+    def _buckets(self, thing_name, hourly):
+        if thing_name is None:
+            return self._fleet_hourly if hourly else self._fleet_daily
+        state = self._feeders.get(thing_name)
+        if state is None:
+            return {}
+        return state.hourly if hourly else state.daily
+
+    def hourly(self, thing_name=None, start=None, end=None):
+        """
+        Hourly feeding totals.
+
+        Parameters
+        ----------
+        thing_name : str, optional
+            Feeder's thing_name from the API.
+            Defaults to the whole fleet.
+        start : datetime or float, optional
+            Inclusive start (UTC)
+        end : datetime or float, optional
+            Exclusive end (UTC)
+
+        Returns
+        -------
+        list of dict
+            One row per hour with feedings, sorted by hour
+
+        """
+        buckets = self._buckets(thing_name, hourly=True)
+        return [
+            _row(key, bucket, "hour")
+            for key, bucket in _select(buckets, _epoch(start), _epoch(end))
+        ]
+
+    def daily(self, thing_name=None, start=None, end=None):
+        """
+        Daily (UTC) feeding totals.
+
+        Parameters
+        ----------
+        thing_name : str, optional
+            Feeder's thing_name from the API.
+            Defaults to the whole fleet.
+        start : datetime or float, optional
+            Inclusive start (UTC)
+        end : datetime or float, optional
+            Exclusive end (UTC)
+
+        Returns
+        -------
+        list of dict
+            One row per day with feedings, sorted by day
+
+        """
+        buckets = self._buckets(thing_name, hourly=False)
+        return [
+            _row(key, bucket, "day")
+            for key, bucket in _select(buckets, _epoch(start), _epoch(end))
+        ]
+
+    def total(self, thing_name=None, start=None, end=None):
+        """
+        Feeding totals over the daily buckets.
+
+        Parameters
+        ----------
+        thing_name : str, optional
+            Feeder's thing_name from the API.
+            Defaults to the whole fleet.
+        start : datetime or float, optional
+            Inclusive start (UTC)
+        end : datetime or float, optional
+            Exclusive end (UTC)
+
+        Returns
+        -------
+        dict
+            Feeds and amounts, split by manual and scheduled
+
+        """
+        totals = [0, 0, 0, 0]
+        buckets = self._buckets(thing_name, hourly=False)
+        for _, bucket in _select(buckets, _epoch(start), _epoch(end)):
+            for index, value in enumerate(bucket):
+                totals[index] += value
+        row = dict(zip(_FIELDS, totals))
+        row["feeds"] = totals[0] + totals[2]
+        row["amount"] = totals[1] + totals[3]
+        return row
+
+    def to_dict(self):
+        """
+        Rollup state as JSON-serializable data.
+
+        """
+        return {
+            "hourly_days": self.hourly_days,
+            "daily_days": self.daily_days,
+            "dedupe_days": self.dedupe_days,
+            "expired": self.expired,
+            "feeders": {
+                thing_name: {
+                    "watermark": state.watermark,
+                    "applied": state.applied,
+                    "hourly": state.hourly,
+                    "daily": state.daily,
+                }
+                for thing_name, state in self._feeders.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data, source=feed_source):
+        """
+        Rebuilds a rollup from `to_dict` data.
+
+        """
+        rollup = cls(
+            data["hourly_days"], data["daily_days"], source, data.get("dedupe_days", 14)
+        )
+        rollup.expired = data.get("expired", 0)
+        for thing_name, saved in data["feeders"].items():
+            state = rollup._feeders[thing_name] = _FeederRollup()
+            state.watermark = saved["watermark"]
+            state.applied = saved["applied"]
+            for name, fleet in (
+                ("hourly", rollup._fleet_hourly),
+                ("daily", rollup._fleet_daily),
+            ):
+                buckets = getattr(state, name)
+                for key, bucket in saved[name].items():
+                    key = int(key)
+                    buckets[key] = bucket
+                    fleet_bucket = fleet.setdefault(key, [0, 0, 0, 0])
+                    for index, value in enumerate(bucket):
+                        fleet_bucket[index] += value
+        return rollup
+
+    def save(self, path):
+        """
+        Saves the rollup state to a JSON file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file
+
+        """
+        with open(path, "w") as fh:
+            json.dump(self.to_dict(), fh)
+
+    @classmethod
+    def load(cls, path, source=feed_source, **kwargs):
+        """
+        Loads a rollup saved with `save`, or creates an empty one if the file
+        does not exist.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file
+        source : callable, optional
+            Function returning "manual" or "scheduled" for a message.
+        **kwargs
+            Arguments for a new rollup if the file does not exist
+
+        Returns
+        -------
+        FeedingRollup
+
+        """
+        try:
+            with open(path) as fh:
+                return cls.from_dict(json.load(fh), source)
+        except FileNotFoundError:
+            return cls(source=source, **kwargs)
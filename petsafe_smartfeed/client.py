@@ -1,17 +1,52 @@
 import json
 import re
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 
-import boto3
 import requests
 
 from petsafe_smartfeed.devices import DeviceSmartFeed
+from petsafe_smartfeed.resilience import (
+    CircuitOpenError,
+    LatencyTracker,
+    Metrics,
+    RequestNotSentError,
+    endpoint_name,
+)
 
 URL_SF_API = "https://platform.cloud.petsafe.net/smart-feed/"
 PETSAFE_CLIENT_ID = "18hpp04puqmgf5nc6o474lcp2g"
 PETSAFE_REGION = "us-east-1"
 
 
+def _start(function, *args):
+    """
+    Runs a function on a new daemon thread.
+
+    Returns
+    -------
+    Future
+        Result of the function
+
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(function(*args))
+        except BaseException as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _close_response(future):
+    if future.exception() is None:
+        future.result().close()
+
+
 class PetSafeClient:
     def __init__(
         self,
@@ -20,6 +55,13 @@ class PetSafeClient:
         refresh_token=None,
         access_token=None,
         session=None,
+        timeout=30,
+        endpoint_timeouts=None,
+        hedge=False,
+        hedge_percentile=95,
+        hedge_min_delay=0.5,
+        circuit_breaker=None,
+        transport=None,
     ):
         """
         Provides a client to PetSafe API.
@@ -36,6 +78,41 @@ class PetSafeClient:
             Authorization access token provided by PetSafe
         session : str, optional
             Authorization session provided by PetSafe
+        timeout : float or tuple, optional
+            Timeout of API requests in seconds, or a (connect, read) tuple.
+            Defaults to 30.
+        endpoint_timeouts : dict, optional
+            Timeouts overriding `timeout` for some endpoints, keyed by
+            endpoint name (e.g. "feeders/*/messages", see `endpoint_name`).
+        hedge : bool, optional
+            If True, a GET request still unanswered after the endpoint's
+            `hedge_percentile` latency is sent a second time and the first
+            response is used.
+            Defaults to False.
+        hedge_percentile : float, optional
+            Latency percentile after which a GET request is hedged.
+            Defaults to 95.
+        hedge_min_delay : float, optional
+            Minimum seconds to wait before hedging.
+            Defaults to 0.5.
+        circuit_breaker : CircuitBreaker, optional
+            If given, requests fail fast with `CircuitOpenError` while the
+            breaker is open.
+        transport : callable, optional
+            Function sending API requests, with the signature of
+            `requests.request` (e.g. `RecordingTransport` or
+            `ReplayTransport`).
+            Defaults to `requests.request`.
+
+        Notes
+        -----
+        `last_feedings` keeps the (timestamp, amount, known_at) of the most
+        recent feeding seen for each feeder, by thing name. `known_at` is the
+        last time that feeding was confirmed to be the most recent one.
+
+        Timeouts, hedged requests and circuit breaker rejections are counted
+        per endpoint in `metrics`. Requests that fail before they are sent
+        (e.g. the tokens cannot be refreshed) raise `RequestNotSentError`.
 
         """
         self.id_token = id_token
@@ -46,7 +123,37 @@ class PetSafeClient:
         self.username = None
         self.token_expires_time = 0
         self.challenge_name = None
-        self.client = boto3.client("cognito-idp", region_name=PETSAFE_REGION)
+        self._client = None
+        self._refresh_lock = threading.Lock()
+        self.timeout = timeout
+        self.endpoint_timeouts = dict(endpoint_timeouts or {})
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.circuit_breaker = circuit_breaker
+        self.transport = transport
+        self.last_feedings = {}
+        self.metrics = Metrics()
+        self.latencies = LatencyTracker()
+
+    @property
+    def client(self):
+        """
+        AWS Cognito client used for authorization.
+
+        It is created on first use, so using the API with valid tokens does
+        not require loading boto3.
+
+        """
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("cognito-idp", region_name=PETSAFE_REGION)
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
 
     @property
     def headers(self):
@@ -64,7 +171,10 @@ class PetSafeClient:
             raise Exception("Not authorized! Have you requested a token?")
 
         if time.time() >= self.token_expires_time - 10:
-            self.refresh_tokens()
+            # feeders are often used from several threads; refresh only once
+            with self._refresh_lock:
+                if time.time() >= self.token_expires_time - 10:
+                    self.refresh_tokens()
 
         headers["Authorization"] = self.id_token
 
@@ -185,6 +295,95 @@ class PetSafeClient:
         )
         return response
 
+    def _send(self, method, url, headers, data, stream, timeout, endpoint):
+        start = time.monotonic()
+        transport = self.transport or requests.request
+        try:
+            response = transport(
+                method, url, headers=headers, json=data, stream=stream, timeout=timeout
+            )
+        except requests.Timeout:
+            # timeouts are the slowest responses; leaving them out would lower
+            # the percentiles and make hedging fire more often than configured
+            self.latencies.record(endpoint, time.monotonic() - start)
+            raise
+        self.latencies.record(endpoint, time.monotonic() - start)
+        return response
+
+    def _send_hedged(self, endpoint, *args):
+        delay = self.latencies.percentile(endpoint, self.hedge_percentile)
+        if delay is None:
+            return self._send(*args)
+
+        # Each attempt gets its own thread: a shared pool would make requests
+        # wait for a free worker, and that wait would count as slowness.
+        first = _start(self._send, *args)
+        done, _ = wait([first], timeout=max(delay, self.hedge_min_delay))
+        if done:
+            return first.result()
+
+        self.metrics.incr("hedge_sent", endpoint)
+        second = _start(self._send, *args)
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is not None or not pending:
+                break
+        if winner is None:
+            return first.result()  # both failed, raise the original error
+
+        for future in pending | done:
+            if future is not winner:
+                future.add_done_callback(_close_response)
+        if winner is second:
+            self.metrics.incr("hedge_won", endpoint)
+        return winner.result()
+
+    def _request(self, method, path, data=None, stream=False):
+        endpoint = endpoint_name(path)
+        # may refresh tokens and fail; do it before the breaker admits the
+        # request, or a failed trial request would never be recorded
+        try:
+            headers = self.headers
+        except Exception as error:
+            raise RequestNotSentError(
+                "Could not authorize, request not sent: %s (%s)" % (path, error)
+            ) from error
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            self.metrics.incr("circuit_rejected", endpoint)
+            raise CircuitOpenError("PetSafe API is failing, request not sent: " + path)
+
+        args = (
+            method,
+            URL_SF_API + path,
+            headers,
+            data,
+            stream,
+            self.endpoint_timeouts.get(endpoint, self.timeout),
+            endpoint,
+        )
+        try:
+            if self.hedge and method == "GET":
+                response = self._send_hedged(endpoint, *args)
+            else:
+                response = self._send(*args)
+        except Exception as error:
+            if isinstance(error, requests.Timeout):
+                self.metrics.incr("timeout", endpoint)
+            if breaker is not None and breaker.record_failure():
+                self.metrics.incr("circuit_opened", endpoint)
+            raise
+
+        if breaker is not None:
+            if response.status_code >= 500:
+                if breaker.record_failure():
+                    self.metrics.incr("circuit_opened", endpoint)
+            else:
+                breaker.record_success()
+        return response
+
     def api_post(self, path="", data=None):
         """
         Sends a POST request to PetSafe.
@@ -211,9 +410,9 @@ class PetSafeClient:
         ... })
 
         """
-        return requests.post(URL_SF_API + path, headers=self.headers, json=data)
+        return self._request("POST", path, data)
 
-    def api_get(self, path=""):
+    def api_get(self, path="", stream=False):
         """
         Sends a GET request to PetSafe.
 
@@ -221,6 +420,9 @@ class PetSafeClient:
         ----------
         path : str
             URL path on the API (it is prepended by the API URL)
+        stream : bool, optional
+            If True, the response body is not downloaded until it is read.
+            Defaults to False.
 
         Returns
         -------
@@ -233,7 +435,7 @@ class PetSafeClient:
         >>> feeders_raw = client.api_get(path="feeders")
 
         """
-        return requests.get(URL_SF_API + path, headers=self.headers)
+        return self._request("GET", path, stream=stream)
 
     def api_put(self, path="", data=None):
         """
@@ -264,7 +466,7 @@ class PetSafeClient:
         ...)
 
         """
-        return requests.put(URL_SF_API + path, headers=self.headers, json=data)
+        return self._request("PUT", path, data)
 
     def api_delete(self, path=""):
         """
@@ -287,4 +489,4 @@ class PetSafeClient:
         >>> response = client.api_delete(feeder.api_path + "schedules/1")
 
         """
-        return requests.delete(URL_SF_API + path, headers=self.headers)
+        return self._request("DELETE", path)
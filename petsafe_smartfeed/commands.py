@@ -0,0 +1,458 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from petsafe_smartfeed.devices import DeviceSmartFeed
+from petsafe_smartfeed.resilience import CircuitOpenError, RequestNotSentError
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_UNKNOWN = "unknown"
+STATUS_SUPERSEDED = "superseded"
+
+# Commands that are safe to send twice. Anything else that was in flight when
+# the process died is parked as `unknown` instead of being replayed, so a crash
+# between the request and the bookkeeping can never double-feed.
+IDEMPOTENT_KINDS = ("put_setting",)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commands (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    thing_name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    collapse_key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS commands_status ON commands (status, thing_name, seq);
+"""
+
+
+def _failure_status(error, kind):
+    """
+    Status of a command whose request failed.
+
+    Failures that guarantee the request was not carried out (it could not be
+    authorized, the connection could not be made, throttling, an open circuit
+    breaker) keep the command pending. Timeouts and server errors only do so
+    for idempotent commands: the server may have carried out a feed anyway, so
+    those are parked as unknown. Any other HTTP error (bad setting name,
+    unknown feeder, ...) will not fix itself by retrying.
+
+    """
+    if isinstance(error, RequestNotSentError):
+        return STATUS_PENDING
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        if status == 429:
+            return STATUS_PENDING
+        if status < 500:
+            return STATUS_FAILED
+    elif isinstance(error, requests.ConnectionError):
+        # includes ConnectTimeout, but not ReadTimeout
+        return STATUS_PENDING
+    elif not isinstance(error, requests.Timeout):
+        return STATUS_FAILED
+    return STATUS_PENDING if kind in IDEMPOTENT_KINDS else STATUS_UNKNOWN
+
+
+class CommandQueue:
+    def __init__(self, path=":memory:", max_attempts=10, lease=300):
+        """
+        Durable outbound queue for `DeviceSmartFeed` commands.
+
+        Commands are persisted in a SQLite database before anything is sent,
+        so they survive the API (or the process) going away. `drain` replays
+        them once the API is reachable again.
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the SQLite database file.
+            Defaults to an in-memory database (not durable).
+        max_attempts : int, optional
+            Number of transient failures after which a command is marked as
+            failed instead of being retried.
+            Defaults to 10.
+        lease : float, optional
+            Seconds a drain may take to send one command. Commands still
+            being sent after their lease expired are assumed to be left over
+            by a process that died.
+            Defaults to 300.
+
+        Notes
+        -----
+        Every command has an idempotency key. Enqueueing a key that is already
+        known (pending or sent) is a no-op, and a command is only ever sent
+        once successfully.
+
+        Examples
+        --------
+        >>> queue = CommandQueue("commands.db")
+        >>> queue.feed(feeder, amount=2, key="breakfast-2021-06-01")
+        >>> queue.put_setting(feeder, "paused", True)
+        >>> queue.put_setting(feeder, "paused", False)  # replaces the previous
+        >>> queue.drain(client)
+
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._recover()
+
+    def _recover(self):
+        """
+        Handles commands left in flight by a process that died, i.e. whose
+        lease expired. Commands other processes are sending are left alone.
+
+        """
+        now = time.time()
+        expired = "status = ? AND (lease_until IS NULL OR lease_until < ?)"
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE commands SET status = ?, updated_at = ? WHERE %s "
+                "AND kind IN (%s)" % (expired, ",".join("?" * len(IDEMPOTENT_KINDS))),
+                (STATUS_PENDING, now, STATUS_SENDING, now) + IDEMPOTENT_KINDS,
+            )
+            self._db.execute(
+                "UPDATE commands SET status = ?, updated_at = ? WHERE " + expired,
+                (STATUS_UNKNOWN, now, STATUS_SENDING, now),
+            )
+
+    def close(self):
+        """
+        Closes the underlying database.
+
+        """
+        self._db.close()
+
+    def enqueue(self, thing_name, kind, payload, key=None, collapse_key=None):
+        """
+        Persists a command to be sent by `drain`.
+
+        Parameters
+        ----------
+        thing_name : str
+            Feeder's thing_name from the API
+        kind : str
+            One of "feed", "add_schedule" or "put_setting"
+        payload : dict
+            Keyword arguments for the command
+        key : str, optional
+            Idempotency key. A random key is generated if omitted.
+        collapse_key : str, optional
+            Pending commands of the same feeder with this collapse key are
+            superseded by this command and never sent. Their keys stay known,
+            so replaying them does not bring them back.
+
+        Returns
+        -------
+        str
+            Idempotency key of the command
+
+        """
+        if key is None:
+            key = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._db:
+            # replaying a known key must not supersede anything
+            if self._db.execute(
+                "SELECT 1 FROM commands WHERE key = ?", (key,)
+            ).fetchone():
+                return key
+            if collapse_key is not None:
+                self._db.execute(
+                    "UPDATE commands SET status = ?, updated_at = ? "
+                    "WHERE thing_name = ? AND collapse_key = ? AND status = ?",
+                    (STATUS_SUPERSEDED, now, thing_name, collapse_key, STATUS_PENDING),
+                )
+            self._db.execute(
+                "INSERT INTO commands (key, thing_name, kind, collapse_key, "
+                "payload, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    thing_name,
+                    kind,
+                    collapse_key,
+                    json.dumps(payload),
+                    STATUS_PENDING,
+                    now,
+                    now,
+                ),
+            )
+        return key
+
+    def feed(self, feeder, amount=1, slow_feed=None, key=None):
+        """
+        Queues `DeviceSmartFeed.feed`.
+
+        Parameters
+        ----------
+        feeder : DeviceSmartFeed
+            Feeder to feed
+        amount : int
+            Amount to feed in increments of 1/8
+        slow_feed : bool, optional
+            If True, will use slow feeding.
+            Defaults to the feeder's current setting.
+        key : str, optional
+            Idempotency key, e.g. derived from the meal and date.
+
+        Returns
+        -------
+        str
+            Idempotency key of the command
+
+        """
+        if slow_feed is None:
+            slow_feed = feeder.slow_feed
+        return self.enqueue(
+            feeder.api_name,
+            "feed",
+            {"amount": amount, "slow_feed": slow_feed},
+            key=key,
+        )
+
+    def add_schedule(self, feeder, time="00:00", amount=1, key=None):
+        """
+        Queues `DeviceSmartFeed.add_schedule`.
+
+        Parameters
+        ----------
+        feeder : DeviceSmartFeed
+            Feeder to add the schedule to
+        time : str
+            Time to dispense the food in 24 hour notation with colon separation (e.g. 16:35 for 4:35PM)
+        amount : int
+            Amount to feed in increments of 1/8
+        key : str, optional
+            Idempotency key
+
+        Returns
+        -------
+        str
+            Idempotency key of the command
+
+        """
+        return self.enqueue(
+            feeder.api_name,
+            "add_schedule",
+            {"time": time, "amount": amount},
+            key=key,
+        )
+
+    def put_setting(self, feeder, setting, value, key=None):
+        """
+        Queues `DeviceSmartFeed.put_setting`.
+
+        Only the most recent pending value of a setting is sent.
+
+        Parameters
+        ----------
+        feeder : DeviceSmartFeed
+            Feeder to change
+        setting : str
+            Name of setting to be changed
+        value
+            Value of setting to apply
+        key : str, optional
+            Idempotency key
+
+        Returns
+        -------
+        str
+            Idempotency key of the command
+
+        """
+        return self.enqueue(
+            feeder.api_name,
+            "put_setting",
+            {"setting": setting, "value": value},
+            key=key,
+            collapse_key="setting:" + setting,
+        )
+
+    def status(self, key):
+        """
+        Status of a queued command.
+
+        Parameters
+        ----------
+        key : str
+            Idempotency key of the command
+
+        Returns
+        -------
+        str or None
+            "pending", "sending", "done", "failed", "unknown", "superseded",
+            or None if the key is not known
+
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status FROM commands WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def pending(self):
+        """
+        Number of commands waiting to be sent.
+
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM commands WHERE status = ?", (STATUS_PENDING,)
+            ).fetchone()[0]
+
+    def purge(self, older_than=7 * 24 * 3600):
+        """
+        Forgets finished commands, including their idempotency keys.
+
+        Parameters
+        ----------
+        older_than : float, optional
+            Age in seconds of the commands to forget.
+            Defaults to 7 days.
+
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM commands WHERE status IN (?, ?, ?, ?) AND updated_at < ?",
+                (
+                    STATUS_DONE,
+                    STATUS_FAILED,
+                    STATUS_UNKNOWN,
+                    STATUS_SUPERSEDED,
+                    time.time() - older_than,
+                ),
+            )
+
+    def _set_status(self, seq, status, error=None, attempt=False):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE commands SET status = ?, last_error = ?, updated_at = ?, "
+                "attempts = attempts + ? WHERE seq = ?",
+                (status, error, time.time(), int(attempt), seq),
+            )
+
+    def _claim(self, seq):
+        """
+        Marks a pending command as being sent.
+
+        Returns
+        -------
+        bool
+            False if another drain already claimed the command
+
+        """
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE commands SET status = ?, lease_until = ?, updated_at = ? "
+                "WHERE seq = ? AND status = ?",
+                (STATUS_SENDING, now + self.lease, now, seq, STATUS_PENDING),
+            )
+            return cursor.rowcount == 1
+
+    def _send(self, feeder, kind, payload):
+        if kind == "feed":
+            feeder.feed(update_data=False, **payload)
+        elif kind == "add_schedule":
+            feeder.add_schedule(update_data=False, **payload)
+        elif kind == "put_setting":
+            feeder.put_setting(payload["setting"], payload["value"])
+        else:
+            raise ValueError("Unknown command: " + kind)
+
+    def _drain_feeder(self, client, thing_name, commands):
+        # A bare device is enough to reuse the mutators; nothing here needs the
+        # feeder's state and fetching it would cost one more request.
+        feeder = DeviceSmartFeed(client, {"thing_name": thing_name, "settings": {}})
+        sent = 0
+        for seq, kind, payload, attempts in commands:
+            if not self._claim(seq):
+                # an overlapping drain is sending this feeder's commands
+                break
+            try:
+                self._send(feeder, kind, json.loads(payload))
+            except Exception as error:
+                # an open breaker rejected the command without trying it
+                attempt = not isinstance(error, CircuitOpenError)
+                status = _failure_status(error, kind)
+                if status == STATUS_PENDING and attempts + attempt >= self.max_attempts:
+                    status = STATUS_FAILED
+                self._set_status(seq, status, str(error), attempt=attempt)
+                if status == STATUS_PENDING:
+                    # keep the per-feeder order: stop and retry on the next drain
+                    break
+                continue
+            self._set_status(seq, STATUS_DONE, attempt=True)
+            sent += 1
+        return sent
+
+    def drain(self, client, max_workers=4):
+        """
+        Sends all pending commands.
+
+        Commands of the same feeder are sent in the order they were queued;
+        different feeders are drained concurrently. A failure that left the
+        command unsent stops that feeder's commands until the next drain.
+        Feeds and schedules that may have been carried out despite a failure
+        (timeout, server error) are marked "unknown" and never resent.
+        Overlapping drains, even from other processes, never send the same
+        command twice, as long as sending a command takes less than `lease`
+        seconds. Commands left in flight by a process that died are recovered
+        once their lease expired: feeds and schedules become "unknown",
+        settings are sent again.
+
+        Parameters
+        ----------
+        client : PetSafeClient
+            Authorized PetSafe client
+        max_workers : int, optional
+            Maximum number of feeders drained at the same time.
+            Defaults to 4.
+
+        Returns
+        -------
+        int
+            Number of commands sent successfully
+
+        """
+        self._recover()
+        by_feeder = {}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, thing_name, kind, payload, attempts FROM commands "
+                "WHERE status = ? ORDER BY seq",
+                (STATUS_PENDING,),
+            ).fetchall()
+        for seq, thing_name, kind, payload, attempts in rows:
+            by_feeder.setdefault(thing_name, []).append((seq, kind, payload, attempts))
+
+        if not by_feeder:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._drain_feeder, client, thing_name, commands)
+                for thing_name, commands in by_feeder.items()
+            ]
+            return sum(future.result() for future in futures)
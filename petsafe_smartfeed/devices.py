@@ -1,6 +1,17 @@
+import codecs
 import json
+import time
 from warnings import warn
 
+from petsafe_smartfeed.analytics import message_time
+
+_STREAM_CHUNK_SIZE = 16 * 1024
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]"
+_NUMBER = "0123456789+-.eE"
+_ESCAPE = "\\u0123456789abcdefABCDEF"
+_LITERALS = ("true", "false", "null", "NaN", "Infinity", "-Infinity")
+
 
 def get_feeders(client):
     """
@@ -31,6 +42,100 @@ def get_feeders(client):
     return [DeviceSmartFeed(client, feeder_data) for feeder_data in json.loads(content)]
 
 
+def _incomplete(buffer, error):
+    """
+    Whether a JSON decoding error may only be due to the buffer ending early.
+
+    """
+    rest = buffer[error.pos :]
+    if error.msg.startswith("Unterminated string"):
+        return True
+    if error.msg.startswith("Invalid \\uXXXX escape"):
+        return all(char in _ESCAPE for char in rest)
+    if any(literal.startswith(rest) for literal in _LITERALS):
+        return True
+    # a number cut after its "." or exponent, e.g. "1." of "1.5"
+    return (
+        error.pos > 0
+        and buffer[error.pos - 1] in _NUMBER
+        and all(char in _NUMBER for char in rest)
+    )
+
+
+def iter_json_array(chunks):
+    """
+    Parses a JSON array incrementally, yielding its items as they complete.
+
+    Only the item being parsed (and at most one chunk of look-ahead) is kept
+    in memory, regardless of the size of the array. Malformed input raises as
+    soon as it is received, without reading the rest of the array.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        UTF-8 encoded JSON array, split in arbitrary chunks
+
+    Yields
+    ------
+    object
+        Decoded array items, in order
+
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    # what the next token must be: "[", an item or "]", an item, or "," or "]"
+    expect = "start"
+    exhausted = False
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if expect == "start":
+                if char != "[":
+                    raise ValueError("Expected a JSON array")
+                expect = "first"
+                position += 1
+                continue
+            if expect == "separator":
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError("Expected ',' or ']' at %r" % char)
+                expect = "item"
+                position += 1
+                continue
+            if char == "]" and expect == "first":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if exhausted or not _incomplete(buffer, error):
+                    raise
+            else:
+                # a number may continue past the end of the buffer ("-3" of
+                # "-3.5"), so only accept it once its delimiter was received
+                if exhausted or (end < len(buffer) and buffer[end] in _DELIMITERS):
+                    yield item
+                    expect = "separator"
+                    position = end
+                    continue
+        elif exhausted:
+            raise ValueError("Unexpected end of JSON array")
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer = buffer[position:] + utf8.decode(b"", final=True)
+        else:
+            buffer = buffer[position:] + utf8.decode(chunk)
+        position = 0
+
+
 class DeviceSmartFeed:
     def __init__(self, client, data):
         """
@@ -123,9 +228,67 @@ class DeviceSmartFeed:
         response.raise_for_status()
         return json.loads(response.content.decode("UTF-8"))
 
-    def get_last_feeding(self):
+    def iter_messages(self, days=7, types=None):
+        """
+        Requests feeder messages since a specified date, parsing them as the
+        response is received.
+
+        Unlike `get_messages_since`, the response is never held in memory as a
+        whole. Closing the generator (or leaving a loop early) stops reading
+        the response.
+
+        Parameters
+        ----------
+        days : int, optional
+            Number of days to request back.
+            Default to 7.
+        types : str or iterable of str, optional
+            Only yield messages with these `message_type` values.
+            Defaults to all messages.
+
+        Yields
+        ------
+        dict
+            JSON data of each message returned from PetSafe
+
+        Examples
+        --------
+        >>> for message in feeder.iter_messages(days=90, types="FEED_DONE"):
+        ...     print(message["created_at"], message["amount"])
+
         """
-        Requests the most recent feeding message within past 7 days.
+        if isinstance(types, str):
+            types = (types,)
+        if types is not None:
+            types = frozenset(types)
+
+        response = self.client.api_get(
+            self.api_path + "messages?days=" + str(days), stream=True
+        )
+        observed_feeding = False
+        try:
+            response.raise_for_status()
+            for message in iter_json_array(
+                response.iter_content(chunk_size=_STREAM_CHUNK_SIZE)
+            ):
+                # messages are newest first: the first feeding is the last one
+                if not observed_feeding and message.get("message_type") == "FEED_DONE":
+                    observed_feeding = True
+                    self._observe_feeding(message)
+                if types is None or message.get("message_type") in types:
+                    yield message
+        finally:
+            response.close()
+
+    def get_last_feeding(self, days=7):
+        """
+        Requests the most recent feeding message within past days.
+
+        Parameters
+        ----------
+        days : int, optional
+            Number of days to request back.
+            Default to 7.
 
         Returns
         -------
@@ -133,11 +296,53 @@ class DeviceSmartFeed:
             JSON data returned from PetSafe
 
         """
-        messages = self.get_messages_since()
-        for message in messages:
-            if message["message_type"] == "FEED_DONE":
-                return message
-        return None
+        return next(self.iter_messages(days=days, types="FEED_DONE"), None)
+
+    def _remember_feeding(self, amount, timestamp):
+        last_feedings = self.client.last_feedings
+        known = last_feedings.get(self.api_name)
+        if known is None or timestamp >= known[0]:
+            last_feedings[self.api_name] = (timestamp, amount, time.time())
+        else:
+            # nothing newer happened: the known feeding is confirmed as of now
+            last_feedings[self.api_name] = known[:2] + (time.time(),)
+
+    def _observe_feeding(self, message):
+        if message.get("amount") is None:
+            return
+        try:
+            timestamp = message_time(message)
+        except (KeyError, TypeError, ValueError):
+            # without a time it cannot be compared, only use it if nothing is known
+            timestamp = float("-inf")
+        self._remember_feeding(message["amount"], timestamp)
+
+    def get_last_feed_amount(self, max_age=None):
+        """
+        Amount of the most recent feeding known without requesting PetSafe,
+        from `feed` calls and received messages.
+
+        Scheduled and button feedings are only known once a message about
+        them was received, so the amount may be stale.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            Maximum seconds since the amount was last known to be current.
+            Defaults to no limit.
+
+        Returns
+        -------
+        int or None
+            Amount, or None if unknown or older than `max_age`
+
+        """
+        known = self.client.last_feedings.get(self.api_name)
+        if known is None:
+            return None
+        if max_age is not None and time.time() - known[2] > max_age:
+            return None
+        return known[1]
 
     def feed(self, amount=1, slow_feed=None, update_data=True):
         """
@@ -166,17 +371,55 @@ class DeviceSmartFeed:
             },
         )
         response.raise_for_status()
+        self._remember_feeding(amount, time.time())
 
         if update_data:
             self.update_data()
 
-    def repeat_feed(self):
+    def repeat_feed(self, update_data=False, max_age=600, days=None):
         """
         Repeats the last feeding.
 
-        """
-        last_feeding = self.get_last_feeding()
-        self.feed(last_feeding["amount"])
+        The amount comes from `get_last_feed_amount` when it was known to be
+        current within `max_age` seconds, so this usually takes a single
+        request. Otherwise the last day of messages is requested, then the
+        last 7 days.
+
+        Parameters
+        ----------
+        update_data : bool
+            If True, updates ALL device data after the request.
+            Defaults to False.
+        max_age : float, optional
+            Maximum age in seconds of a locally known amount. A scheduled or
+            button feeding since then would not be known, so a larger value
+            saves requests at the cost of accuracy. Use 0 to always request
+            the history.
+            Defaults to 600.
+        days : int, optional
+            If given, only this many days of messages are requested (a single
+            request) when the amount is not known locally.
+
+        Returns
+        -------
+        int or None
+            Amount fed, or None if no previous feeding was found
+            (nothing is fed)
+
+        """
+        amount = self.get_last_feed_amount(max_age)
+        if amount is None:
+            windows = (days,) if days is not None else (1, 7)
+            for window in windows:
+                last_feeding = self.get_last_feeding(days=window)
+                if last_feeding is not None:
+                    amount = last_feeding["amount"]
+                    break
+            else:
+                return None
+
+        self.feed(amount, update_data=update_data)
+        return amount
 
     def prime(self):
         """
@@ -0,0 +1,220 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (metric name, help, feeder attribute)
+FEEDER_METRICS = (
+    ("petsafe_feeder_battery_level", "Battery level (0-100).", "battery_level"),
+    ("petsafe_feeder_battery_voltage", "Battery voltage.", "battery_voltage"),
+    (
+        "petsafe_feeder_food_low_status",
+        "Food level (0 if full, 1 if low, 2 if empty).",
+        "food_low_status",
+    ),
+    ("petsafe_feeder_paused", "1 if scheduled feeds are paused.", "paused"),
+    ("petsafe_feeder_slow_feed", "1 if slow feeding is enabled.", "slow_feed"),
+    ("petsafe_feeder_child_lock", "1 if the button is disabled.", "child_lock"),
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _value(feeder, attribute):
+    try:
+        value = getattr(feeder, attribute)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if value is None:
+        return None
+    return repr(float(value))
+
+
+def render(feeders, refresh_duration=None, refresh_time=None, errors=0):
+    """
+    Renders feeder state in the Prometheus text exposition format.
+
+    Parameters
+    ----------
+    feeders : list of DeviceSmartFeed
+        Feeders to render
+    refresh_duration : float, optional
+        Seconds it took to request the feeders
+    refresh_time : float, optional
+        Time the feeders were requested (seconds since the epoch)
+    errors : int, optional
+        Number of failed refreshes so far
+
+    Returns
+    -------
+    bytes
+
+    """
+    lines = []
+    labels = []
+    for feeder in feeders:
+        labels.append(
+            '{thing_name="%s",friendly_name="%s"}'
+            % (
+                _escape(feeder.api_name),
+                _escape((feeder.data.get("settings") or {}).get("friendly_name") or ""),
+            )
+        )
+
+    lines.append("# HELP petsafe_feeder_info Feeder known to the account.")
+    lines.append("# TYPE petsafe_feeder_info gauge")
+    lines.extend("petsafe_feeder_info%s 1" % label for label in labels)
+
+    for name, help_text, attribute in FEEDER_METRICS:
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s gauge" % name)
+        for feeder, label in zip(feeders, labels):
+            value = _value(feeder, attribute)
+            if value is not None:
+                lines.append(name + label + " " + value)
+
+    lines.append("# HELP petsafe_exporter_feeders Number of feeders.")
+    lines.append("# TYPE petsafe_exporter_feeders gauge")
+    lines.append("petsafe_exporter_feeders %d" % len(feeders))
+    lines.append("# HELP petsafe_exporter_refresh_errors_total Failed refreshes.")
+    lines.append("# TYPE petsafe_exporter_refresh_errors_total counter")
+    lines.append("petsafe_exporter_refresh_errors_total %d" % errors)
+    if refresh_duration is not None:
+        name = "petsafe_exporter_refresh_duration_seconds"
+        lines.append("# HELP %s Duration of the last refresh." % name)
+        lines.append("# TYPE %s gauge" % name)
+        lines.append("%s %r" % (name, refresh_duration))
+    if refresh_time is not None:
+        name = "petsafe_exporter_last_refresh_timestamp_seconds"
+        lines.append("# HELP %s Time of the last successful refresh." % name)
+        lines.append("# TYPE %s gauge" % name)
+        lines.append("%s %r" % (name, refresh_time))
+    lines.append("")
+    return "\n".join(lines).encode("utf-8")
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FleetExporter:
+    def __init__(self, client, interval=300):
+        """
+        Prometheus exporter for the state of all feeders of an account.
+
+        Feeders are requested in the background every `interval` seconds and
+        the metrics page is rendered once per refresh. Scrapes only return the
+        rendered page, so they never cause API requests.
+
+        Parameters
+        ----------
+        client : PetSafeClient
+            Authorized PetSafe client
+        interval : float, optional
+            Seconds between refreshes.
+            Defaults to 300 (PetSafe locks accounts polled more often).
+
+        Examples
+        --------
+        >>> exporter = FleetExporter(client)
+        >>> exporter.serve(port=9100)  # blocks, serves /metrics
+
+        """
+        self.client = client
+        self.interval = interval
+        self.errors = 0
+        self.metrics = render([])
+        self._last = ([], None, None)
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def refresh(self):
+        """
+        Requests all feeders and renders the metrics page.
+
+        Failures (of the request or of rendering unexpected feeder data) are
+        counted and the previous page keeps being served.
+
+        """
+        start = time.time()
+        try:
+            last = (self.client.feeders, time.time() - start, start)
+            metrics = render(*last, errors=self.errors)
+        except Exception:
+            self.errors += 1
+            self.metrics = render(*self._last, errors=self.errors)
+            return False
+        self._last = last
+        self.metrics = metrics
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """
+        Starts refreshing in a background thread.
+
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops refreshing and serving.
+
+        """
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def serve(self, host="", port=9100):
+        """
+        Starts refreshing and serves the metrics page on /metrics until
+        `stop` is called.
+
+        Parameters
+        ----------
+        host : str, optional
+            Address to listen on.
+            Defaults to all addresses.
+        port : int, optional
+            Port to listen on.
+            Defaults to 9100.
+
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.metrics
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer((host, port), Handler)
+        self.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
@@ -0,0 +1,224 @@
+import re
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_FEEDER_PATH = re.compile(r"^feeders/[^/]+")
+_SCHEDULE_PATH = re.compile(r"/schedules/[^/]+")
+
+
+class RequestNotSentError(Exception):
+    """
+    Raised when a request failed before it was sent, e.g. because the tokens
+    could not be refreshed. The original error is the exception's cause.
+
+    """
+
+
+class CircuitOpenError(RequestNotSentError):
+    """
+    Raised instead of sending a request while the circuit breaker is open.
+
+    """
+
+
+def endpoint_name(path):
+    """
+    Groups API paths by endpoint, e.g. "feeders/*/schedules/*".
+
+    Feeder thing names, schedule IDs and query strings are replaced or removed
+    so that timeouts, latencies and metrics are tracked per endpoint rather
+    than per feeder.
+
+    Parameters
+    ----------
+    path : str
+        URL path on the API
+
+    Returns
+    -------
+    str
+
+    """
+    path = path.split("?", 1)[0].rstrip("/")
+    path = _FEEDER_PATH.sub("feeders/*", path)
+    return _SCHEDULE_PATH.sub("/schedules/*", path)
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Thread-safe counters of resilience events per endpoint.
+
+        Events are "timeout", "hedge_sent", "hedge_won", "circuit_opened" and
+        "circuit_rejected".
+
+        """
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def incr(self, event, endpoint):
+        with self._lock:
+            counts = self._counts.setdefault(event, {})
+            counts[endpoint] = counts.get(endpoint, 0) + 1
+
+    def count(self, event, endpoint=None):
+        """
+        Number of times an event fired, for one endpoint or in total.
+
+        """
+        with self._lock:
+            counts = self._counts.get(event, {})
+            if endpoint is None:
+                return sum(counts.values())
+            return counts.get(endpoint, 0)
+
+    def snapshot(self):
+        """
+        Copy of all counters.
+
+        Returns
+        -------
+        dict
+            Counts by event, then by endpoint
+
+        """
+        with self._lock:
+            return {event: dict(counts) for event, counts in self._counts.items()}
+
+
+class LatencyTracker:
+    def __init__(self, window=200, min_samples=20):
+        """
+        Recent response latencies per endpoint.
+
+        Parameters
+        ----------
+        window : int, optional
+            Number of latencies kept per endpoint.
+            Defaults to 200.
+        min_samples : int, optional
+            Number of latencies needed before a percentile is reported.
+            Defaults to 20.
+
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, endpoint, percent):
+        """
+        Latency percentile of an endpoint.
+
+        Returns
+        -------
+        float or None
+            Seconds, or None if there are not enough samples yet
+
+        """
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(int(len(ordered) * percent / 100.0), len(ordered) - 1)
+        return ordered[index]
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, recovery_time=30.0):
+        """
+        Fails requests fast while the API keeps failing.
+
+        After `failure_threshold` consecutive failures the circuit opens and
+        requests are rejected for `recovery_time` seconds. Then a single trial
+        request is let through: success closes the circuit, failure opens it
+        again.
+
+        Parameters
+        ----------
+        failure_threshold : int, optional
+            Consecutive failures (connection errors, timeouts, 5xx responses)
+            that open the circuit.
+            Defaults to 5.
+        recovery_time : float, optional
+            Seconds the circuit stays open before a trial request.
+            Defaults to 30.
+
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        """
+        "closed", "open" or "half-open".
+
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return CLOSED
+        if time.monotonic() - self._opened_at >= self.recovery_time:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self):
+        """
+        Whether a request may be sent now.
+
+        """
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """
+        Records a failed request.
+
+        Returns
+        -------
+        bool
+            True if this failure opened the circuit
+
+        """
+        with self._lock:
+            self._failures += 1
+            if self._trial:
+                # the trial request failed, stay open for another period
+                self._trial = False
+                self._opened_at = time.monotonic()
+                return True
+            if self._opened_at is None and self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                return True
+            return False
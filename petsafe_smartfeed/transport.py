@@ -0,0 +1,225 @@
+import base64
+import gzip
+import json
+import re
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+REDACTED = "REDACTED"
+
+_SECRET_KEY = re.compile(r"token|authorization|password|secret|session", re.IGNORECASE)
+
+
+def _redact(value):
+    """
+    Copy of JSON data with secrets replaced, and whether anything changed.
+
+    """
+    if isinstance(value, dict):
+        redacted = {}
+        changed = False
+        for key, item in value.items():
+            if _SECRET_KEY.search(str(key)) and item is not None:
+                redacted[key] = REDACTED
+                changed = True
+            else:
+                redacted[key], item_changed = _redact(item)
+                changed = changed or item_changed
+        return redacted, changed
+    if isinstance(value, list):
+        items = [_redact(item) for item in value]
+        return [item for item, _ in items], any(changed for _, changed in items)
+    return value, False
+
+
+def _request_key(method, url, data):
+    return method, url, json.dumps(data, sort_keys=True)
+
+
+class RecordingTransport:
+    def __init__(self, path, transport=None):
+        """
+        Records API requests and responses to a file for `ReplayTransport`.
+
+        Only the method, URL, JSON body, status, content type, response body
+        and latency are recorded. Request headers (including the authorization
+        token) are never written, and JSON values under keys that look like
+        secrets ("token", "password", ...) are redacted. Response bodies that
+        are not UTF-8 text are stored base64-encoded, so they replay unchanged.
+
+        Parameters
+        ----------
+        path : str
+            Path of the recording (gzip-compressed JSON lines)
+        transport : callable, optional
+            Transport actually sending the requests.
+            Defaults to `requests.request`.
+
+        Examples
+        --------
+        >>> with RecordingTransport("session.jsonl.gz") as recorder:
+        ...     client = PetSafeClient(email, refresh_token=token, transport=recorder)
+        ...     feeders = client.feeders
+
+        """
+        self.path = path
+        self.transport = transport
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def __call__(self, method, url, **kwargs):
+        transport = self.transport or requests.request
+        start = time.monotonic()
+        response = transport(method, url, **kwargs)
+        content = response.content  # reads streamed responses as well
+        elapsed = time.monotonic() - start
+
+        entry = {
+            "method": method,
+            "url": url,
+            "json": _redact(kwargs.get("json"))[0],
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type"),
+            "elapsed": round(elapsed, 6),
+        }
+        try:
+            text = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["content"] = base64.b64encode(content).decode("ascii")
+            entry["encoding"] = "base64"
+        else:
+            try:
+                body, changed = _redact(json.loads(text))
+            except ValueError:
+                changed = False
+            entry["content"] = json.dumps(body) if changed else text
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+        return response
+
+    def close(self):
+        """
+        Finishes writing the recording.
+
+        """
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayTransport:
+    def __init__(self, path, realtime=False, speed=1.0, loop=True):
+        """
+        Answers API requests from a `RecordingTransport` recording, without
+        any network access.
+
+        Requests are matched on method, URL and JSON body; identical requests
+        are answered with their recorded responses in order.
+
+        Parameters
+        ----------
+        path : str
+            Path of the recording
+        realtime : bool, optional
+            If True, each response is delayed by its recorded latency
+            (divided by `speed`). Otherwise responses are immediate, so only
+            the library's own CPU cost is measured.
+            Defaults to False.
+        speed : float, optional
+            Latency divisor when `realtime` is True.
+            Defaults to 1.
+        loop : bool, optional
+            If True, requests repeated more often than recorded get the
+            recorded responses again from the start (handy for benchmarks).
+            Defaults to True.
+
+        """
+        self.realtime = realtime
+        self.speed = speed
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._queues = {}
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                entry = json.loads(line)
+                key = _request_key(entry["method"], entry["url"], entry["json"])
+                self._entries.setdefault(key, []).append(entry)
+        for key, entries in self._entries.items():
+            self._queues[key] = deque(entries)
+
+    def _next_entry(self, method, url, data):
+        # recorded request bodies are redacted, so match them redacted
+        key = _request_key(method, url, _redact(data)[0])
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                raise LookupError("Request not recorded: %s %s" % (method, url))
+            if not queue:
+                if not self.loop:
+                    raise LookupError("Recording exhausted: %s %s" % (method, url))
+                queue.extend(self._entries[key])
+            return queue.popleft()
+
+    def __call__(self, method, url, **kwargs):
+        entry = self._next_entry(method, url, kwargs.get("json"))
+        if self.realtime:
+            time.sleep(entry["elapsed"] / self.speed)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.url = url
+        response.encoding = "utf-8"
+        response.headers = CaseInsensitiveDict()
+        if entry["content_type"] is not None:
+            response.headers["Content-Type"] = entry["content_type"]
+        if entry.get("encoding") == "base64":
+            response._content = base64.b64decode(entry["content"])
+        else:
+            response._content = entry["content"].encode("utf-8")
+        response._content_consumed = True
+        return response
+
+
+def replay_client(path, email="replay@example.com", **kwargs):
+    """
+    Creates a `PetSafeClient` answered from a recording.
+
+    The client has placeholder tokens that never expire, so it does not try to
+    authorize with PetSafe.
+
+    Parameters
+    ----------
+    path : str
+        Path of the recording
+    email : str, optional
+        Email address of the client
+    **kwargs
+        Arguments for `ReplayTransport`
+
+    Returns
+    -------
+    PetSafeClient
+
+    """
+    from petsafe_smartfeed.client import PetSafeClient
+
+    client = PetSafeClient(
+        email,
+        id_token=REDACTED,
+        refresh_token=REDACTED,
+        access_token=REDACTED,
+        transport=ReplayTransport(path, **kwargs),
+    )
+    client.token_expires_time = float("inf")
+    return client
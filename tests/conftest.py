@@ -0,0 +1,51 @@
+import json
+import threading
+
+import requests
+
+
+def make_response(status_code=200, content=b"{}"):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response._content_consumed = True
+    return response
+
+
+class FakeClient:
+    """
+    Stand-in for `PetSafeClient` recording the API calls.
+
+    `error` is raised (an exception) or returned (a status code) by every call,
+    and `messages` maps the requested number of days to the messages returned.
+
+    """
+
+    def __init__(self, error=None, messages=None):
+        self.error = error
+        self.messages = messages or {}
+        self.calls = []
+        self.last_feedings = {}
+        self.lock = threading.Lock()
+
+    def _call(self, method, path, data=None):
+        with self.lock:
+            self.calls.append((method, path, data))
+        if isinstance(self.error, Exception):
+            raise self.error
+        if self.error is not None:
+            return make_response(self.error)
+        if "days=" in path:
+            days = int(path.split("days=")[1])
+            content = json.dumps(self.messages.get(days, [])).encode()
+            return make_response(content=content)
+        return make_response()
+
+    def api_get(self, path="", stream=False):
+        return self._call("GET", path)
+
+    def api_post(self, path="", data=None):
+        return self._call("POST", path, data)
+
+    def api_put(self, path="", data=None):
+        return self._call("PUT", path, data)
@@ -0,0 +1,69 @@
+import time
+
+from petsafe_smartfeed.analytics import FeedingRollup
+
+
+def feeding(message_id, timestamp, amount=1, source="schedule"):
+    return {
+        "id": message_id,
+        "message_type": "FEED_DONE",
+        "created_at": timestamp,
+        "amount": amount,
+        "source": source,
+    }
+
+
+def test_messages_are_applied_once():
+    now = time.time()
+    messages = [feeding(1, now - 60, 2), feeding(2, now - 7200, 3, "manual")]
+    rollup = FeedingRollup()
+    assert rollup.update("T1", messages) == 2
+    assert rollup.update("T1", messages) == 0
+    total = rollup.total()
+    assert total["feeds"] == 2
+    assert total["amount"] == 5
+    assert total["manual_amount"] == 3
+    assert total["scheduled_amount"] == 2
+
+
+def test_late_messages_are_counted():
+    now = time.time()
+    rollup = FeedingRollup()
+    rollup.update("T1", [feeding(2, now - 60)])
+    assert rollup.update("T1", [feeding(2, now - 60), feeding(1, now - 3600)]) == 1
+    assert rollup.total("T1")["feeds"] == 2
+
+
+def test_expired_messages_are_reported():
+    now = time.time()
+    rollup = FeedingRollup(daily_days=1)
+    assert rollup.update("T1", [feeding(1, now - 5 * 86400)]) == 0
+    assert rollup.expired == 1
+    assert rollup.total()["feeds"] == 0
+
+
+def test_message_ids_are_kept_for_dedupe_days_only(monkeypatch):
+    now = time.time()
+    rollup = FeedingRollup(dedupe_days=2)
+    rollup.update("T1", [feeding(1, now - 60), feeding(2, now - 86400)])
+    assert rollup.update("T1", [feeding(3, now - 3 * 86400)]) == 0
+    assert rollup.expired == 1
+
+    monkeypatch.setattr(time, "time", lambda: now + 1.5 * 86400)
+    rollup.update("T1", [])
+    assert list(rollup._feeders["T1"].applied) == ["1"]
+    assert rollup.total()["feeds"] == 2
+
+
+def test_fleet_totals_and_persistence(tmp_path):
+    now = time.time()
+    rollup = FeedingRollup()
+    rollup.update("T1", [feeding(1, now - 60, 2)])
+    rollup.update("T2", [feeding(1, now - 60, 4)])
+    path = str(tmp_path / "rollup.json")
+    rollup.save(path)
+
+    loaded = FeedingRollup.load(path)
+    assert loaded.total()["amount"] == 6
+    assert loaded.total("T2")["amount"] == 4
+    assert loaded.update("T1", [feeding(1, now - 60, 2)]) == 0
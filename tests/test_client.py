@@ -0,0 +1,152 @@
+import threading
+
+import pytest
+import requests
+
+from petsafe_smartfeed import (
+    CircuitBreaker,
+    CircuitOpenError,
+    PetSafeClient,
+    RequestNotSentError,
+    resilience,
+)
+
+from conftest import make_response
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+def make_client(transport, **kwargs):
+    client = PetSafeClient("email@example.com", id_token="token", **kwargs)
+    client.token_expires_time = float("inf")
+    client.transport = transport
+    return client
+
+
+def test_breaker_opens_and_recovers(clock):
+    state = {"down": True}
+
+    def transport(method, url, **kwargs):
+        if state["down"]:
+            raise requests.ConnectionError("down")
+        return make_response()
+
+    client = make_client(transport, circuit_breaker=CircuitBreaker(2, 30))
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.api_get("feeders")
+    with pytest.raises(CircuitOpenError):
+        client.api_get("feeders")
+
+    clock.now += 30
+    state["down"] = False
+    client.api_get("feeders")
+    assert client.circuit_breaker.state == "closed"
+    assert client.metrics.count("circuit_opened") == 1
+    assert client.metrics.count("circuit_rejected") == 1
+
+
+def test_failing_headers_do_not_leave_breaker_half_open(clock):
+    client = make_client(
+        lambda method, url, **kwargs: make_response(500),
+        circuit_breaker=CircuitBreaker(1, 30),
+    )
+    client.api_get("feeders")
+    clock.now += 30
+
+    client.token_expires_time = 0
+
+    def refresh_tokens():
+        raise RuntimeError("cognito unavailable")
+
+    client.refresh_tokens = refresh_tokens
+    with pytest.raises(RequestNotSentError) as info:
+        client.api_get("feeders")
+    assert isinstance(info.value.__cause__, RuntimeError)
+
+    client.token_expires_time = float("inf")
+    client.transport = lambda method, url, **kwargs: make_response()
+    client.api_get("feeders")
+    assert client.circuit_breaker.state == "closed"
+
+
+def test_timeouts_count_as_latency():
+    def transport(method, url, **kwargs):
+        raise requests.ReadTimeout("slow")
+
+    client = make_client(transport)
+    with pytest.raises(requests.ReadTimeout):
+        client.api_get("feeders")
+    assert client.metrics.count("timeout", "feeders") == 1
+    assert len(client.latencies._samples["feeders"]) == 1
+
+
+def test_hedging_does_not_queue_concurrent_requests():
+    requests_in_flight = threading.Barrier(32, timeout=10)
+
+    def transport(method, url, **kwargs):
+        requests_in_flight.wait()
+        return make_response()
+
+    client = make_client(None, hedge=True, hedge_min_delay=60)
+    client.transport = lambda method, url, **kwargs: make_response()
+    for _ in range(client.latencies.min_samples):
+        client.api_get("feeders")
+
+    # all requests must be sent at once, or the barrier breaks
+    client.transport = transport
+    errors = []
+
+    def get():
+        try:
+            client.api_get("feeders")
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=get) for _ in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert client.metrics.count("hedge_sent") == 0
+
+
+def test_hedge_takes_first_reply():
+    slow = threading.Event()
+    calls = []
+
+    def transport(method, url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            # the original request stays unanswered until the hedge won
+            slow.wait(10)
+        return make_response()
+
+    client = make_client(None, hedge=True, hedge_min_delay=0.01)
+    client.transport = lambda method, url, **kwargs: make_response()
+    for _ in range(client.latencies.min_samples):
+        client.api_get("feeders")
+
+    client.transport = transport
+    try:
+        client.api_get("feeders")
+        assert not slow.is_set()
+    finally:
+        slow.set()
+    assert len(calls) == 2
+    assert client.metrics.count("hedge_won") == 1
@@ -0,0 +1,141 @@
+import pytest
+import requests
+
+from petsafe_smartfeed.commands import CommandQueue
+from petsafe_smartfeed.devices import DeviceSmartFeed
+from petsafe_smartfeed.resilience import CircuitOpenError, RequestNotSentError
+
+from conftest import FakeClient
+
+
+@pytest.fixture
+def feeder():
+    return DeviceSmartFeed(None, {"thing_name": "T1", "settings": {"slow_feed": False}})
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = CommandQueue(str(tmp_path / "commands.db"))
+    yield queue
+    queue.close()
+
+
+def test_feed_key_is_sent_once(queue, feeder):
+    client = FakeClient()
+    queue.feed(feeder, 2, key="meal")
+    queue.feed(feeder, 2, key="meal")
+    assert queue.drain(client) == 1
+    queue.feed(feeder, 2, key="meal")
+    assert queue.drain(client) == 0
+    assert client.calls == [
+        ("POST", "feeders/T1/meals", {"amount": 2, "slow_feed": False})
+    ]
+
+
+def test_put_setting_collapses(queue, feeder):
+    client = FakeClient()
+    queue.put_setting(feeder, "paused", True)
+    queue.put_setting(feeder, "paused", False)
+    assert queue.pending() == 1
+    queue.drain(client)
+    assert client.calls == [("PUT", "feeders/T1/settings/paused", {"value": False})]
+
+
+def test_replayed_key_does_not_supersede(queue, feeder):
+    queue.put_setting(feeder, "paused", True, key="a")
+    queue.drain(FakeClient())
+    queue.put_setting(feeder, "paused", False, key="b")
+    queue.put_setting(feeder, "paused", True, key="a")
+    assert queue.status("b") == "pending"
+    assert queue.pending() == 1
+
+
+def test_replayed_superseded_key_stays_superseded(queue, feeder):
+    client = FakeClient()
+    queue.put_setting(feeder, "paused", True, key="a")
+    queue.put_setting(feeder, "paused", False, key="b")
+    queue.put_setting(feeder, "paused", True, key="a")
+    assert queue.status("a") == "superseded"
+    queue.drain(client)
+    assert queue.status("b") == "done"
+    assert client.calls == [("PUT", "feeders/T1/settings/paused", {"value": False})]
+
+
+def test_overlapping_drains_send_once(queue, feeder):
+    queue.feed(feeder, 2, key="meal")
+    other = CommandQueue(queue.path)
+    client = FakeClient()
+    assert queue.drain(client) + other.drain(client) == 1
+    other.close()
+    # a drain that read the row before it was claimed must not send it again
+    queue.feed(feeder, 1, key="snack")
+    seq = queue._db.execute("SELECT seq FROM commands WHERE key = 'snack'").fetchone()
+    assert queue._claim(seq[0])
+    assert queue._drain_feeder(client, "T1", [(seq[0], "feed", "{}", 0)]) == 0
+    assert len(client.calls) == 1
+
+
+def test_connection_error_stays_pending(queue, feeder):
+    queue.feed(feeder, 2, key="meal")
+    queue.drain(FakeClient(requests.ConnectionError("down")))
+    assert queue.status("meal") == "pending"
+
+
+def test_unsent_request_stays_pending_until_max_attempts(queue, feeder):
+    queue.feed(feeder, 2, key="meal")
+    client = FakeClient(RequestNotSentError("cognito unavailable"))
+    for attempt in range(queue.max_attempts):
+        assert queue.status("meal") == "pending"
+        queue.drain(client)
+    assert queue.status("meal") == "failed"
+
+
+@pytest.mark.parametrize(
+    "error", [requests.ReadTimeout("slow"), 503], ids=["read-timeout", "5xx"]
+)
+def test_ambiguous_feed_failure_is_not_retried(queue, feeder, error):
+    queue.feed(feeder, 2, key="meal")
+    queue.put_setting(feeder, "paused", True, key="pause")
+    client = FakeClient(error)
+    queue.drain(client)
+    assert queue.status("meal") == "unknown"
+    # idempotent commands are retried
+    assert queue.status("pause") == "pending"
+    queue.drain(FakeClient())
+    assert queue.status("meal") == "unknown"
+
+
+def test_client_error_fails(queue, feeder):
+    queue.put_setting(feeder, "bogus", 1, key="bad")
+    queue.drain(FakeClient(400))
+    assert queue.status("bad") == "failed"
+
+
+def test_recover_parks_in_flight_feeds(queue, feeder):
+    queue.feed(feeder, 2, key="meal")
+    queue.put_setting(feeder, "paused", True, key="pause")
+    queue._db.execute("UPDATE commands SET status = 'sending', lease_until = 0")
+    queue._db.commit()
+    reopened = CommandQueue(queue.path)
+    assert reopened.status("meal") == "unknown"
+    assert reopened.status("pause") == "pending"
+    reopened.close()
+
+
+def test_recover_leaves_commands_of_live_drains_alone(queue, feeder):
+    queue.put_setting(feeder, "paused", True, key="pause")
+    seq = queue._db.execute("SELECT seq FROM commands").fetchone()[0]
+    assert queue._claim(seq)
+    other = CommandQueue(queue.path)
+    client = FakeClient()
+    assert other.drain(client) == 0
+    assert other.status("pause") == "sending"
+    assert client.calls == []
+    other.close()
+
+
+def test_open_circuit_keeps_commands_pending(queue, feeder):
+    queue.feed(feeder, 2, key="meal")
+    for _ in range(queue.max_attempts + 1):
+        queue.drain(FakeClient(CircuitOpenError("open")))
+    assert queue.status("meal") == "pending"
@@ -0,0 +1,151 @@
+import json
+
+import pytest
+
+from petsafe_smartfeed.devices import DeviceSmartFeed, iter_json_array
+
+from conftest import FakeClient
+
+ITEMS = [
+    {"id": 1, "message_type": "FEED_DONE", "amount": 2},
+    {"text": 'quotes " and brackets ]}[, inside', "emoji": "\U0001f431 éè"},
+    -3.5e2,
+    12,
+    True,
+    None,
+    "猫",
+    [],
+    {},
+    {"nested": [-1.5e-30, True, False, None, {"a": "\\u", "b": 2e10}]},
+]
+
+
+def split(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("ensure_ascii", [False, True])
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 1 << 20])
+def test_chunk_boundaries(size, ensure_ascii):
+    data = json.dumps(ITEMS, ensure_ascii=ensure_ascii).encode("utf-8")
+    assert list(iter_json_array(split(data, size))) == ITEMS
+
+
+def test_number_split_across_chunks():
+    assert list(iter_json_array([b"[1", b"23", b".4", b"5e", b"1]"])) == [123.45e1]
+
+
+def test_multibyte_character_split_across_chunks():
+    data = json.dumps(["é\U0001f431"], ensure_ascii=False).encode("utf-8")
+    for index in range(1, len(data)):
+        assert list(iter_json_array([data[:index], data[index:]])) == [
+            "é\U0001f431"
+        ]
+
+
+@pytest.mark.parametrize("data", [b"[]", b"  [ ]  ", b"[\n]"])
+def test_empty_array(data):
+    assert list(iter_json_array([data])) == []
+
+
+def test_stops_early():
+    def chunks():
+        yield b'[{"a": 1}, '
+        raise AssertionError("read past the first item")
+
+    assert next(iter_json_array(chunks())) == {"a": 1}
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"[",
+        b'[{"a": 1}',
+        b'[{"a": 1},',
+        b'[{"a": ',
+        b"[1",
+        b'["ab',
+        b"[[tr",
+        b"[[-",
+        b'[["\\u12',
+        b'[{"a": 1.',
+        b'[{"a": 1e-',
+    ],
+)
+def test_truncated_input(data):
+    with pytest.raises(ValueError):
+        list(iter_json_array(split(data, 2)))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"{}", b"[1 2]", b"[1,,2]", b"[,1]", b"[1,]", b"[,]", b'[{"a" 1}]', b"[1}"],
+)
+def test_malformed_input(data):
+    with pytest.raises(ValueError):
+        list(iter_json_array([data]))
+
+
+@pytest.mark.parametrize(
+    "data", [b'[{"a" 1}', b"[[1 2", b"[[trux", b'[["\\x', b'[{"a": 1.x', b"[{1"]
+)
+def test_malformed_item_raises_before_reading_on(data):
+    def chunks():
+        yield data
+        raise AssertionError("read past the malformed item")
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunks()))
+
+
+def make_feeder(messages):
+    client = FakeClient(messages=messages)
+    feeder = DeviceSmartFeed(
+        client, {"thing_name": "T1", "settings": {"slow_feed": False}}
+    )
+    return feeder, client
+
+
+FEED_DONE = {"message_type": "FEED_DONE", "amount": 3, "created_at": 1600000000}
+
+
+def test_repeat_feed_uses_recent_local_amount():
+    feeder, client = make_feeder({})
+    feeder.feed(4, update_data=False)
+    client.calls.clear()
+    assert feeder.repeat_feed() == 4
+    assert client.calls == [
+        ("POST", "feeders/T1/meals", {"amount": 4, "slow_feed": False})
+    ]
+
+
+def test_repeat_feed_ignores_stale_local_amount():
+    feeder, client = make_feeder({1: [{"message_type": "X"}, FEED_DONE]})
+    feeder.feed(4, update_data=False)
+    client.calls.clear()
+    assert feeder.repeat_feed(max_age=0) == 3
+    assert client.calls[0] == ("GET", "feeders/T1/messages?days=1", None)
+    assert len(client.calls) == 2
+
+
+def test_repeat_feed_falls_back_to_week():
+    feeder, client = make_feeder({7: [FEED_DONE]})
+    assert feeder.repeat_feed() == 3
+    assert [call[1] for call in client.calls] == [
+        "feeders/T1/messages?days=1",
+        "feeders/T1/messages?days=7",
+        "feeders/T1/meals",
+    ]
+
+
+def test_repeat_feed_single_window():
+    feeder, client = make_feeder({7: [FEED_DONE]})
+    assert feeder.repeat_feed(days=7) == 3
+    assert len(client.calls) == 2
+
+
+def test_repeat_feed_without_history():
+    feeder, client = make_feeder({})
+    assert feeder.repeat_feed() is None
+    assert all(call[0] == "GET" for call in client.calls)
@@ -0,0 +1,71 @@
+import threading
+import time
+import urllib.request
+
+from petsafe_smartfeed.devices import DeviceSmartFeed
+from petsafe_smartfeed.exporter import FleetExporter, render
+
+
+class FeedersClient:
+    def __init__(self, feeders):
+        self._feeders = feeders
+        self.calls = 0
+
+    @property
+    def feeders(self):
+        self.calls += 1
+        return self._feeders
+
+
+def make_feeder(data):
+    return DeviceSmartFeed(None, dict(data))
+
+
+def test_render_escapes_labels_and_skips_missing_fields():
+    feeders = [
+        make_feeder(
+            {
+                "thing_name": "T1",
+                "settings": {"friendly_name": 'Say "hi"\\\n', "paused": True},
+            }
+        ),
+        make_feeder({"thing_name": "T2", "settings": None}),
+    ]
+    lines = render(feeders, errors=2).decode("utf-8").splitlines()
+
+    label = '{thing_name="T1",friendly_name="Say \\"hi\\"\\\\\\n"}'
+    assert "petsafe_feeder_info" + label + " 1" in lines
+    assert "petsafe_feeder_paused" + label + " 1.0" in lines
+    assert 'petsafe_feeder_info{thing_name="T2",friendly_name=""} 1' in lines
+    assert not any(line.startswith("petsafe_feeder_battery") for line in lines)
+    assert not any("T2" in line for line in lines if "feeder_paused{" in line)
+    assert "petsafe_exporter_feeders 2" in lines
+    assert "petsafe_exporter_refresh_errors_total 2" in lines
+
+
+def test_refresh_counts_render_failures():
+    exporter = FleetExporter(FeedersClient([object()]))
+    assert exporter.refresh() is False
+    assert exporter.errors == 1
+    assert b"petsafe_exporter_refresh_errors_total 1" in exporter.metrics
+
+
+def test_scrapes_do_not_call_the_client():
+    client = FeedersClient([make_feeder({"thing_name": "T1", "settings": {}})])
+    exporter = FleetExporter(client, interval=3600)
+    thread = threading.Thread(target=exporter.serve, args=("127.0.0.1", 0))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while b"T1" not in exporter.metrics or exporter._server is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        url = "http://127.0.0.1:%d/metrics" % exporter._server.server_address[1]
+        for _ in range(3):
+            with urllib.request.urlopen(url, timeout=10) as response:
+                body = response.read()
+        assert b'petsafe_feeder_info{thing_name="T1",friendly_name=""} 1' in body
+        assert client.calls == 1
+    finally:
+        exporter.stop()
+        thread.join(10)
@@ -0,0 +1,86 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from petsafe_smartfeed import __main__ as cli
+from petsafe_smartfeed.client import URL_SF_API
+
+FEEDERS = [
+    {
+        "thing_name": "T1",
+        "settings": {"friendly_name": "Kitchen", "paused": False},
+    },
+    {
+        "thing_name": "T2",
+        "settings": {"friendly_name": "Hall", "paused": True},
+    },
+]
+
+MESSAGES = [
+    {"id": 1, "message_type": "FEED_DONE", "created_at": 1600000000, "amount": 2},
+    {"id": 2, "message_type": "FOOD_LOW", "created_at": 1600000100},
+]
+
+
+def get(path, content):
+    return {
+        "method": "GET",
+        "url": URL_SF_API + path,
+        "json": None,
+        "status": 200,
+        "content_type": "application/json",
+        "content": json.dumps(content),
+        "elapsed": 0.01,
+    }
+
+
+@pytest.fixture
+def recording(tmp_path):
+    # messages of T2 are not recorded, so exporting them fails
+    path = str(tmp_path / "session.jsonl.gz")
+    with gzip.open(path, "wt", encoding="utf-8") as fh:
+        for entry in (
+            get("feeders", FEEDERS),
+            get("feeders/T1/messages?days=7", MESSAGES),
+        ):
+            fh.write(json.dumps(entry) + "\n")
+    return path
+
+
+def test_email_is_an_alias_of_login(monkeypatch):
+    calls = []
+    monkeypatch.setattr(cli, "command_login", lambda args: calls.append(args) or 0)
+    assert cli.main(["email@example.com"]) == 0
+    assert calls[0].email == "email@example.com"
+
+
+def test_commands_changing_feeders_require_a_selection(recording):
+    with pytest.raises(SystemExit) as info:
+        cli.main(["--replay", recording, "feed"])
+    assert "--all" in str(info.value.code)
+
+
+def test_status_ndjson(recording, capsys):
+    assert cli.main(["--replay", recording, "status", "--feeder", "Hall"]) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(row["feeder"], row["paused"]) for row in rows] == [("T2", True)]
+
+
+def test_messages_export_ndjson(recording, capsys):
+    argv = ["--replay", recording, "messages", "export", "--feeder", "T1"]
+    assert cli.main(argv + ["--type", "FEED_DONE"]) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows == [dict(MESSAGES[0], feeder="T1")]
+
+
+def test_messages_export_csv_reports_errors(recording, capsys):
+    argv = ["--replay", recording, "messages", "export", "--format", "csv"]
+    assert cli.main(argv) == 1
+    rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+    assert [row["id"] for row in rows if row["feeder"] == "T1"] == ["1", "2"]
+    (failed,) = [row for row in rows if row["feeder"] == "T2"]
+    assert failed["ok"] == "False"
+    assert "not recorded" in failed["error"]
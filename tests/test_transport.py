@@ -0,0 +1,84 @@
+import gzip
+import json
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+
+from petsafe_smartfeed.transport import (
+    REDACTED,
+    RecordingTransport,
+    ReplayTransport,
+)
+
+from conftest import make_response
+
+URL = "https://example.com/"
+DATA = {"password": "hunter2", "amount": 1}
+
+
+def record(path, responses):
+    """
+    Records requests answered by `responses`, keyed by URL, in order.
+
+    """
+    remaining = {url: list(bodies) for url, bodies in responses.items()}
+
+    def transport(method, url, **kwargs):
+        response = make_response(content=remaining[url].pop(0))
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+        return response
+
+    with RecordingTransport(path, transport) as recorder:
+        for url, bodies in responses.items():
+            for _ in bodies:
+                recorder(
+                    "POST",
+                    url,
+                    headers={"Authorization": "id-token"},
+                    json=DATA,
+                )
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "session.jsonl.gz")
+
+
+def test_round_trip_redacts_secrets(path):
+    record(path, {URL + "auth": [b'{"token": "abc", "user": {"session": "x"}}']})
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        recorded = fh.read()
+    for secret in ("abc", "hunter2", "id-token", '"x"'):
+        assert secret not in recorded
+
+    replay = ReplayTransport(path)
+    response = replay("POST", URL + "auth", json=DATA)
+    assert response.json() == {"token": REDACTED, "user": {"session": REDACTED}}
+    assert response.headers["content-type"] == "application/json"
+
+
+def test_identical_requests_replay_in_order(path):
+    record(path, {URL + "a": [b"[1]", b"[2]"], URL + "b": [b"[3]"]})
+    replay = ReplayTransport(path, loop=False)
+    request = {"json": {"password": "other", "amount": 1}}
+    assert replay("POST", URL + "a", **request).json() == [1]
+    assert replay("POST", URL + "b", **request).json() == [3]
+    assert replay("POST", URL + "a", **request).json() == [2]
+    with pytest.raises(LookupError):
+        replay("POST", URL + "a", **request)
+    with pytest.raises(LookupError):
+        replay("POST", URL + "c", **request)
+
+
+def test_loop_repeats_recorded_responses(path):
+    record(path, {URL: [b"[1]", b"[2]"]})
+    replay = ReplayTransport(path)
+    assert [replay("POST", URL, json=DATA).json() for _ in range(3)] == [[1], [2], [1]]
+
+
+def test_binary_body_and_iter_content(path):
+    body = b'["\xff\xfe", ' + json.dumps("é" * 100).encode("utf-8") + b"]"
+    record(path, {URL: [body]})
+    response = ReplayTransport(path)("POST", URL, json=DATA)
+    assert response.content == body
+    assert b"".join(response.iter_content(chunk_size=7)) == body